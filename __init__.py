@@ -5,6 +5,6 @@ __version__ = "0.0.1"
 __license__ = "GPL"
 __description__ = "A simple file system simulator for educational purposes."
 
-from .models import File, Directory, FileSystem
+from .models import File, Directory, ContentStore, FileSystem, AsyncFileSystem
 
-__all__ = ["File", "Directory", "FileSystem"]
\ No newline at end of file
+__all__ = ["File", "Directory", "ContentStore", "FileSystem", "AsyncFileSystem"]
\ No newline at end of file
@@ -1,18 +1,57 @@
+import asyncio
+import copyreg
 import csv
 import datetime
 import logging
+import io
 import pickle
 import os
+import tempfile
+import threading
 import time
+import weakref
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
 class File:
     def __init__(self, name, content=''):
         self.name = name
+        self._store = None
+        self._spill = None  # (offset, length, is_text) of this content in the spill file
         self.content = content
         self.size = len(content)
         self.creation_date = datetime.datetime.now()
         self.modification_date = self.creation_date
 
+    @property
+    def content(self):
+        if self._store is not None:
+            return self._store.fetch(self)
+        return self._content
+
+    @content.setter
+    def content(self, value):
+        if self._store is not None:
+            self._store.update(self, value)
+        else:
+            self._content = value
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        if self._store is not None:
+            state['_content'] = self._store.peek(self)
+        state['_store'] = None
+        state['_spill'] = None
+        return state
+
+    def __setstate__(self, state):
+        if 'content' in state:  # State files written before the content store
+            state['_content'] = state.pop('content')
+        state.setdefault('_content', None)
+        state.setdefault('_store', None)
+        state.setdefault('_spill', None)
+        self.__dict__.update(state)
+
     def update_content(self, new_content):
         if self.content != new_content:
             self.content = new_content
@@ -27,6 +66,207 @@ class File:
             'modification_date': self.modification_date
         }
 
+def _encode_content(content):
+    # Text is stored as UTF-8; anything else a File was given is pickled
+    if isinstance(content, str):
+        return content.encode('utf-8', 'surrogatepass'), True
+    return pickle.dumps(content), False
+
+def _decode_content(data, is_text):
+    if is_text:
+        return data.decode('utf-8', 'surrogatepass')
+    return pickle.loads(data)
+
+def _remove_spill_file(handle, path):
+    handle.close()
+    if os.path.exists(path):
+        os.remove(path)
+
+# Keeps file contents within a memory budget (in bytes), spilling the least
+# recently used ones to a private temp file and faulting them back in on access
+class ContentStore:
+    compact_threshold = 1 << 20
+
+    def __init__(self, memory_budget=None, spill_dir=None):
+        self.memory_budget = memory_budget
+        self.spill_dir = spill_dir
+        self.spill_file = None
+        self.resident_bytes = 0
+        self.spill_bytes = 0
+        self.dead_spill_bytes = 0
+        self.hits = 0
+        self.faults = 0
+        self.evictions = 0
+        self.fault_time_ns = 0
+        self._files = {}  # id(file) -> weakref to file, for every attached file
+        self._resident = OrderedDict()  # id(file) -> resident bytes, in LRU order
+        self._spilled = {}  # id(file) -> bytes held in the spill file
+        self._spill_handle = None
+        self._spill_finalizer = None
+        self._lock = threading.RLock()
+        self.closed = False
+
+    def attach(self, file):
+        key = id(file)
+        with self._lock:
+            if key in self._files:
+                return
+            file._store = self
+            # Files dropped from the tree are forgotten as soon as they are collected
+            self._files[key] = weakref.ref(file, lambda _, key=key: self._forget(key))
+            if file._content is not None:
+                self._admit(key, file._content)
+                self._evict()
+
+    def fetch(self, file):
+        key = id(file)
+        with self._lock:
+            if key in self._resident:
+                self._resident.move_to_end(key)
+                self.hits += 1
+                return file._content
+            start_time = time.perf_counter_ns()
+            content = self._read_spill(file._spill)
+            file._content = content
+            self.faults += 1
+            self.fault_time_ns += time.perf_counter_ns() - start_time
+            # The spilled copy stays valid, so evicting this content again is free
+            self._admit(key, content)
+            self._evict()
+            return content
+
+    def peek(self, file):
+        with self._lock:
+            content = file._content
+            if content is not None:
+                return content
+            return self._read_spill(file._spill)
+
+    def update(self, file, content):
+        key = id(file)
+        with self._lock:
+            self._release_spill(key)
+            file._spill = None
+            self._discard(key)
+            file._content = content
+            self._admit(key, content)
+            self._evict()
+
+    def close(self):
+        # Spilled offsets die with the spill file, so a closed store cannot spill or fault again
+        with self._lock:
+            self.closed = True
+            if self._spill_finalizer is not None:
+                self._spill_finalizer()
+                self._spill_finalizer = None
+                self._spill_handle = None
+                self.spill_file = None
+
+    def statistics(self):
+        with self._lock:
+            return {
+                "memory_budget": self.memory_budget,
+                "resident_files": len(self._resident),
+                "resident_bytes": self.resident_bytes if self.memory_budget is not None else None,
+                "spill_bytes": self.spill_bytes,
+                "dead_spill_bytes": self.dead_spill_bytes,
+                "hits": self.hits,
+                "faults": self.faults,
+                "evictions": self.evictions,
+                "fault_time_ms": self.fault_time_ns / 1_000_000,
+                "avg_fault_time_ms": (self.fault_time_ns / self.faults / 1_000_000) if self.faults else 0.0
+            }
+
+    def _admit(self, key, content):
+        # Sizes only matter against a budget, so skip the encoding cost without one
+        size = 0
+        if self.memory_budget is not None:
+            size = len(content) if isinstance(content, bytes) else len(_encode_content(content)[0])
+        self._resident[key] = size
+        self.resident_bytes += size
+
+    def _discard(self, key):
+        size = self._resident.pop(key, None)
+        if size is not None:
+            self.resident_bytes -= size
+
+    def _forget(self, key):
+        with self._lock:
+            self._files.pop(key, None)
+            self._discard(key)
+            self._release_spill(key)
+
+    def _release_spill(self, key):
+        length = self._spilled.pop(key, None)
+        if length is not None:
+            self.spill_bytes -= length
+            self.dead_spill_bytes += length
+
+    def _evict(self):
+        if self.memory_budget is None:
+            return
+        # The most recently used content always stays, even if it alone exceeds the budget
+        while self.resident_bytes > self.memory_budget and len(self._resident) > 1:
+            key, size = self._resident.popitem(last=False)
+            self.resident_bytes -= size
+            file = self._files[key]()
+            if file is None:  # Collected, but _forget has not run yet
+                self._forget(key)
+                continue
+            if file._spill is None:
+                file._spill = self._write_spill(file._content)
+                self._spilled[key] = file._spill[1]
+                self.spill_bytes += file._spill[1]
+            file._content = None
+            self.evictions += 1
+        if self.dead_spill_bytes > max(self.compact_threshold, self.spill_bytes):
+            self._compact()
+
+    def _open_spill(self):
+        fd, path = tempfile.mkstemp(prefix='filesystem_', suffix='.spill', dir=self.spill_dir)
+        handle = os.fdopen(fd, 'w+b')
+        return handle, path, weakref.finalize(self, _remove_spill_file, handle, path)
+
+    def _check_open(self):
+        if self.closed:
+            raise RuntimeError("ContentStore is closed")
+
+    def _write_spill(self, content):
+        self._check_open()
+        if self._spill_handle is None:
+            self._spill_handle, self.spill_file, self._spill_finalizer = self._open_spill()
+        data, is_text = _encode_content(content)
+        self._spill_handle.seek(0, os.SEEK_END)
+        offset = self._spill_handle.tell()
+        self._spill_handle.write(data)
+        return offset, len(data), is_text
+
+    def _read_spill(self, spill):
+        self._check_open()
+        offset, length, is_text = spill
+        self._spill_handle.seek(offset)
+        data = self._spill_handle.read(length)
+        if len(data) != length:
+            raise OSError(f"Spill file {self.spill_file} is truncated: expected {length} bytes at offset {offset}, got {len(data)}")
+        return _decode_content(data, is_text)
+
+    def _compact(self):
+        # Copy live contents one at a time into a fresh spill file, then drop the old one
+        handle, path, finalizer = self._open_spill()
+        for key in list(self._spilled):
+            file = self._files[key]()
+            if file is None:
+                self._forget(key)
+                continue
+            offset, length, is_text = file._spill
+            self._spill_handle.seek(offset)
+            data = self._spill_handle.read(length)
+            file._spill = (handle.tell(), length, is_text)
+            handle.write(data)
+        self._spill_finalizer()
+        self._spill_handle, self.spill_file, self._spill_finalizer = handle, path, finalizer
+        self.dead_spill_bytes = 0
+
 class Directory:
     def __init__(self, name):
         self.name = name
@@ -53,6 +293,30 @@ class Directory:
             'directories': list(self.directories.keys())
         }
 
+_STATE_MAGIC = b'FSSTATE\x01'
+
+class _StatePickler(pickle.Pickler):
+    # Writes each file's content to ``contents`` and pickles only its position
+    def __init__(self, file, contents, store):
+        super().__init__(file)
+        self.contents = contents
+        self.store = store
+
+    def reducer_override(self, obj):
+        if not isinstance(obj, File):
+            return NotImplemented
+        content = self.store.peek(obj)
+        state = {key: value for key, value in obj.__dict__.items() if key not in ('_content', '_store', '_spill')}
+        if isinstance(content, str):
+            data = content.encode('utf-8', 'surrogatepass')
+            offset = self.contents.tell()
+            self.contents.write(data)
+            state['_stored'] = (offset, len(data))
+        else:
+            # Non-text contents are rare enough to keep inline, as older state files did
+            state['_content'] = content
+        return copyreg.__newobj__, (File,), state
+
 class FileSystem:
     logging.basicConfig(level=logging.INFO,
                         format='%(asctime)s - %(levelname)s - %(message)s',
@@ -62,9 +326,10 @@ class FileSystem:
                             logging.StreamHandler()
                         ])
 
-    def __init__(self, root_path="/", state_file='filesystem_state.pkl'):
+    def __init__(self, root_path="/", state_file='filesystem_state.pkl', memory_budget=None, spill_dir=None):
         self.root_path = root_path
         self.state_file = state_file
+        self.content_store = ContentStore(memory_budget, spill_dir)
         self.root = Directory(root_path)
         self.load_state()
 
@@ -98,6 +363,7 @@ class FileSystem:
             directory = self._get_directory(path)
         if directory:
             new_file = File(name, content)
+            self.content_store.attach(new_file)
             directory.add_file(new_file)
             self.save_state()
         self._log_performance("create", start_time)
@@ -152,21 +418,63 @@ class FileSystem:
 
     def _gather_stats(self, directory, stats):
         stats["total_directories"] += 1
-        for file in directory.files.values():
+        # Walk snapshots so AsyncFileSystem can serve this while a change runs on its executor
+        for file in list(directory.files.values()):
             stats["total_files"] += 1
             stats["total_size"] += file.size
-        for subdir in directory.directories.values():
+        for subdir in list(directory.directories.values()):
             self._gather_stats(subdir, stats)
 
+    def cache_statistics(self):
+        return self.content_store.statistics()
+
+    def _attach_contents(self, directory):
+        for file in directory.files.values():
+            self.content_store.attach(file)
+        for subdir in directory.directories.values():
+            self._attach_contents(subdir)
+
     def save_state(self):
-        with open(self.state_file, 'wb') as f:
-            pickle.dump(self, f)
+        # Contents are streamed into the file ahead of the pickled tree, so
+        # saving never needs more than one file's content in memory
+        temp_file = self.state_file + '.tmp'
+        with open(temp_file, 'wb') as f:
+            f.write(_STATE_MAGIC)
+            tree = io.BytesIO()
+            _StatePickler(tree, f, self.content_store).dump(self.root)
+            tree_offset = f.tell()
+            f.write(tree.getvalue())
+            f.write(tree_offset.to_bytes(8, 'little'))
+        os.replace(temp_file, self.state_file)
 
     def load_state(self):
         if os.path.exists(self.state_file):
             with open(self.state_file, 'rb') as f:
-                loaded_fs = pickle.load(f)
-                self.root = loaded_fs.root
+                if f.read(len(_STATE_MAGIC)) == _STATE_MAGIC:
+                    f.seek(-8, os.SEEK_END)
+                    f.seek(int.from_bytes(f.read(8), 'little'))
+                    self.root = pickle.load(f)
+                    self._load_contents(self.root, f)
+                else:
+                    # Older state files pickled the whole FileSystem with contents inline
+                    f.seek(0)
+                    self.root = pickle.load(f).root
+                    self._attach_contents(self.root)
+
+    def _load_contents(self, directory, f):
+        # Attaching each content as it is read lets the store spill as it goes
+        for file in directory.files.values():
+            stored = file.__dict__.pop('_stored', None)
+            if stored is not None:
+                offset, length = stored
+                f.seek(offset)
+                data = f.read(length)
+                if len(data) != length:
+                    raise OSError(f"State file {self.state_file} is truncated: expected {length} bytes at offset {offset}, got {len(data)}")
+                file._content = data.decode('utf-8', 'surrogatepass')
+            self.content_store.attach(file)
+        for subdir in directory.directories.values():
+            self._load_contents(subdir, f)
 
     def create_virtual_drive(self, drive_name):
         virtual_drive_path = os.path.join(self.root_path, drive_name.strip("/"))
@@ -188,6 +496,7 @@ class FileSystem:
         if source_directory and source_name in source_directory.files:
             file_to_copy = source_directory.files[source_name]
             new_file = File(destination_name, file_to_copy.content)
+            self.content_store.attach(new_file)
             destination_directory.add_file(new_file)
         elif source_directory and source_name in source_directory.directories:
             dir_to_copy = source_directory.directories[source_name]
@@ -200,6 +509,7 @@ class FileSystem:
     def _copy_directory_contents(self, source_directory, destination_directory):
         for file in source_directory.files.values():
             new_file = File(file.name, file.content)
+            self.content_store.attach(new_file)
             destination_directory.add_file(new_file)
         for dir in source_directory.directories.values():
             new_sub_dir = Directory(dir.name)
@@ -240,10 +550,10 @@ class FileSystem:
         return results
 
     def _search_directory(self, directory, search_term, results):
-        for file_name, file in directory.files.items():
+        for file_name, file in list(directory.files.items()):
             if search_term in file_name:
                 results.append(file)
-        for dir_name, dir in directory.directories.items():
+        for dir_name, dir in list(directory.directories.items()):
             if search_term in dir_name:
                 results.append(dir)
             self._search_directory(dir, search_term, results)
@@ -251,6 +561,9 @@ class FileSystem:
     def _log_performance(self, operation, start_time):
         end_time = time.time_ns()
         elapsed_time_ms = (end_time - start_time) / 1_000_000  # Convert to milliseconds
+        self._record_performance(operation, elapsed_time_ms)
+
+    def _record_performance(self, operation, elapsed_time_ms):
         logging.info(f"Operation: {operation}, Time taken: {elapsed_time_ms:.2f} ms")
         
         # Open the CSV file or create it if it doesn't exist, then append the new data
@@ -258,3 +571,157 @@ class FileSystem:
             csvwriter = csv.writer(csvfile)
             # Write the operation and elapsed time in milliseconds to the CSV file
             csvwriter.writerow([operation, elapsed_time_ms])
+
+class _DeferredFileSystem(FileSystem):
+    # Leaves persistence and metrics I/O to the AsyncFileSystem that owns it
+    def __init__(self, *args, record_performance=None, **kwargs):
+        self._deferred_record = record_performance
+        super().__init__(*args, **kwargs)
+
+    def save_state(self):
+        pass
+
+    def _record_performance(self, operation, elapsed_time_ms):
+        self._deferred_record(operation, elapsed_time_ms)
+
+# asyncio facade over FileSystem: saves and metrics I/O run on an executor,
+# and concurrent writers share a single pending save
+class AsyncFileSystem:
+    def __init__(self, root_path="/", state_file='filesystem_state.pkl', memory_budget=None, spill_dir=None, executor=None):
+        # A single worker keeps saves and CSV rows in submission order
+        self._owns_executor = executor is None
+        self._executor = executor or ThreadPoolExecutor(max_workers=1)
+        self.fs = _DeferredFileSystem(root_path, state_file, memory_budget, spill_dir,
+                                      record_performance=self._submit_performance)
+        self.persist_count = 0
+        self._offload = memory_budget is not None
+        self._closed = False
+        self._lock = asyncio.Lock()
+        self._next_persist = None
+        self._flush_task = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        # Writers already queued on the lock still run, so keep draining their saves
+        while True:
+            if self._flush_task is not None:
+                await asyncio.shield(self._flush_task)
+            async with self._lock:
+                if self._flush_task is None and self._next_persist is None:
+                    if self._owns_executor:
+                        self._executor.shutdown(wait=False)
+                    self.fs.content_store.close()
+                    return
+
+    async def create_file(self, path, name, content=''):
+        return await self._mutate(self.fs.create_file, path, name, content)
+
+    async def create_directory(self, path):
+        return await self._mutate(self.fs._create_directory, path)
+
+    async def write_file(self, path, content):
+        return await self._mutate(self.fs.write_file, path, content)
+
+    async def delete(self, path):
+        return await self._mutate(self.fs.delete, path)
+
+    async def copy(self, source_path, destination_path):
+        return await self._mutate(self.fs.copy, source_path, destination_path)
+
+    async def move(self, source_path, destination_path):
+        return await self._mutate(self.fs.move, source_path, destination_path)
+
+    async def rename(self, path, new_name):
+        return await self._mutate(self.fs.rename, path, new_name)
+
+    async def create_virtual_drive(self, drive_name):
+        return await self._mutate(self.fs.create_virtual_drive, drive_name)
+
+    async def read_file(self, path):
+        return await self._read(self.fs.read_file, path)
+
+    async def list_dir(self, path):
+        self._check_open()
+        return self.fs.list_dir(path)
+
+    async def search(self, directory_path, search_term):
+        self._check_open()
+        return self.fs.search(directory_path, search_term)
+
+    async def statistics(self):
+        self._check_open()
+        return self.fs.statistics()
+
+    async def cache_statistics(self):
+        self._check_open()
+        return self.fs.cache_statistics()
+
+    async def save_state(self):
+        await self._mutate(lambda: None)
+
+    async def load_state(self):
+        self._check_open()
+        async with self._lock:
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(self._executor, self.fs.load_state)
+
+    def _check_open(self):
+        if self._closed:
+            raise RuntimeError("AsyncFileSystem is closed")
+
+    async def _read(self, operation, *args):
+        # Only reads that touch contents can fault from the spill file
+        self._check_open()
+        if not self._offload:
+            return operation(*args)
+        async with self._lock:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, operation, *args)
+
+    async def _mutate(self, operation, *args):
+        self._check_open()
+        # Saves hold the lock while pickling, so a change made here is either
+        # in the save already running or in the next one
+        async with self._lock:
+            if self._offload:
+                result = await asyncio.get_running_loop().run_in_executor(self._executor, operation, *args)
+            else:
+                result = operation(*args)
+            if self._next_persist is None:
+                self._next_persist = asyncio.get_running_loop().create_future()
+            persisted = self._next_persist
+        if self._flush_task is None:
+            self._flush_task = asyncio.get_running_loop().create_task(self._flush())
+        # Shielded so a cancelled writer does not cancel the save it shares
+        await asyncio.shield(persisted)
+        return result
+
+    async def _flush(self):
+        loop = asyncio.get_running_loop()
+        try:
+            while self._next_persist is not None:
+                async with self._lock:
+                    persisted = self._next_persist
+                    self._next_persist = None
+                    try:
+                        await loop.run_in_executor(self._executor, FileSystem.save_state, self.fs)
+                        self.persist_count += 1
+                        persisted.set_result(None)
+                    except Exception as e:
+                        persisted.set_exception(e)
+                    finally:
+                        # Never leave writers waiting, e.g. if the loop is shutting down
+                        if not persisted.done():
+                            persisted.cancel()
+        finally:
+            self._flush_task = None
+
+    def _submit_performance(self, operation, elapsed_time_ms):
+        self._executor.submit(FileSystem._record_performance, self.fs, operation, elapsed_time_ms)
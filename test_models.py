@@ -1,10 +1,13 @@
 # test_models.py
 
+import asyncio
 import os
 import unittest
 import datetime
 import time
-from models import File, Directory, FileSystem
+import weakref
+from unittest import mock
+from models import File, Directory, FileSystem, ContentStore, AsyncFileSystem
 
 class TestFile(unittest.TestCase):
     def test_file_creation(self):
@@ -142,5 +145,252 @@ class TestFileSystem(unittest.TestCase):
         self.assertEqual(stats["total_size"], len("Hello World"))
         self.setUp()
 
+class TestContentStore(unittest.TestCase):
+    def setUp(self):
+        self.state_file = 'budget_state.pkl'
+        if os.path.exists(self.state_file):
+            os.remove(self.state_file)
+        self.fs = FileSystem(state_file=self.state_file, memory_budget=10)
+
+    def tearDown(self):
+        self.fs.content_store.close()
+        if os.path.exists(self.state_file):
+            os.remove(self.state_file)
+
+    def test_unbounded_store_never_evicts(self):
+        store = ContentStore()
+        for i in range(5):
+            store.attach(File(f"file{i}.txt", "x" * 100))
+        self.assertEqual(store.evictions, 0)
+
+    def test_cold_contents_are_evicted(self):
+        self.fs.create_file("/home", "a.txt", "aaaaaaaa")
+        self.fs.create_file("/home", "b.txt", "bbbbbbbb")
+        a = self.fs._get_directory("/home").files["a.txt"]
+        self.assertIsNone(a._content)
+        self.assertEqual(a.size, 8)
+        stats = self.fs.cache_statistics()
+        self.assertEqual(stats["evictions"], 1)
+        self.assertEqual(stats["resident_bytes"], 8)
+
+    def test_read_faults_content_back_in(self):
+        self.fs.create_file("/home", "a.txt", "aaaaaaaa")
+        self.fs.create_file("/home", "b.txt", "bbbbbbbb")
+        self.assertEqual(self.fs.read_file("/home/a.txt"), "aaaaaaaa")
+        self.assertEqual(self.fs.read_file("/home/a.txt"), "aaaaaaaa")
+        self.assertEqual(self.fs.read_file("/home/b.txt"), "bbbbbbbb")
+        stats = self.fs.cache_statistics()
+        self.assertEqual(stats["faults"], 2)
+        self.assertEqual(stats["hits"], 1)
+        self.assertGreaterEqual(stats["fault_time_ms"], 0)
+
+    def test_write_to_evicted_file(self):
+        self.fs.create_file("/home", "a.txt", "aaaaaaaa")
+        self.fs.create_file("/home", "b.txt", "bbbbbbbb")
+        self.fs.write_file("/home/a.txt", "new")
+        self.assertEqual(self.fs.read_file("/home/a.txt"), "new")
+        self.assertEqual(self.fs.read_file("/home/b.txt"), "bbbbbbbb")
+
+    def test_deleted_files_leave_the_store(self):
+        self.fs.create_file("/home", "a.txt", "aaaa")
+        self.fs.delete("/home/a.txt")
+        self.assertEqual(self.fs.cache_statistics()["resident_files"], 0)
+        self.assertEqual(self.fs.cache_statistics()["resident_bytes"], 0)
+
+    def test_saved_state_keeps_evicted_contents(self):
+        self.fs.create_file("/home", "a.txt", "aaaaaaaa")
+        self.fs.create_file("/home", "b.txt", "bbbbbbbb")
+        reloaded = FileSystem(state_file=self.state_file)
+        self.assertEqual(reloaded.read_file("/home/a.txt"), "aaaaaaaa")
+        self.assertEqual(reloaded.read_file("/home/b.txt"), "bbbbbbbb")
+
+    def test_budget_counts_utf8_bytes(self):
+        self.fs.create_file("/home", "a.txt", "\u00e9\u00e9\u00e9")
+        self.assertEqual(self.fs.cache_statistics()["resident_bytes"], 6)
+
+    def test_save_does_not_fault_spilled_contents(self):
+        for i in range(5):
+            self.fs.create_file("/home", f"file{i}.txt", "x" * 8)
+        faults = self.fs.cache_statistics()["faults"]
+        self.fs.save_state()
+        self.assertEqual(self.fs.cache_statistics()["faults"], faults)
+
+    def test_loading_state_stays_within_budget(self):
+        for i in range(5):
+            self.fs.create_file("/home", f"file{i}.txt", "x" * 8)
+        reloaded = FileSystem(state_file=self.state_file, memory_budget=10)
+        self.assertLessEqual(reloaded.cache_statistics()["resident_bytes"], 10)
+        self.assertEqual(reloaded.read_file("/home/file0.txt"), "x" * 8)
+        reloaded.content_store.close()
+
+    def test_instances_do_not_share_spill_files(self):
+        self.fs.create_file("/d", "x", "xxxxxxxx")
+        self.fs.create_file("/d", "y", "yyyyyyyy")
+        self.fs.write_file("/d/x", "rewritten")
+        self.fs.create_file("/d", "z", "zzzzzzzz")
+        other = FileSystem(state_file=self.state_file, memory_budget=10)
+        other.create_file("/d", "w", "wwwwwwww")
+        self.assertEqual(self.fs.read_file("/d/x"), "rewritten")
+        self.assertNotEqual(self.fs.content_store.spill_file, other.content_store.spill_file)
+        other.content_store.close()
+
+    def test_spill_file_stays_bounded_across_rewrites(self):
+        self.fs.content_store.compact_threshold = 64
+        for i in range(4):
+            self.fs.create_file("/home", f"file{i}.txt", "x" * 8)
+        for round in range(20):
+            for i in range(4):
+                self.fs.write_file(f"/home/file{i}.txt", str(round % 10) * 8)
+        store = self.fs.content_store
+        self.assertLessEqual(os.path.getsize(store.spill_file), 2 * store.spill_bytes + store.compact_threshold + 8)
+        self.assertEqual(self.fs.read_file("/home/file0.txt"), "9" * 8)
+
+    def test_closed_store_refuses_stale_offsets(self):
+        self.fs.create_file("/a", "x", "xxxxxxxx")
+        self.fs.create_file("/a", "y", "yyyyyyyy")
+        self.fs.content_store.close()
+        with self.assertRaises(RuntimeError):
+            self.fs.create_file("/a", "z", "zzzzzzzz")
+        with self.assertRaises(RuntimeError):
+            self.fs.read_file("/a/x")
+
+    def test_eviction_skips_collected_files(self):
+        store = ContentStore(memory_budget=10)
+        a = File("a.txt", "aaaaaaaa")
+        store.attach(a)
+        # Stand in for a file collected on another thread before _forget ran
+        gone = File("gone.txt")
+        store._files[id(a)] = weakref.ref(gone)
+        del gone
+        b = File("b.txt", "bbbbbbbb")
+        store.attach(b)
+        self.assertEqual(store.evictions, 0)
+        self.assertEqual(store.statistics()["resident_files"], 1)
+        store.close()
+
+    def test_non_text_contents_survive_spill_and_save(self):
+        self.fs.create_file("/b", "bin", b"\x00\x01")
+        self.fs.create_file("/b", "surrogate", "\ud800")
+        self.fs.create_file("/b", "filler", "ffffffffff")
+        self.assertEqual(self.fs.read_file("/b/bin"), b"\x00\x01")
+        self.assertEqual(self.fs.read_file("/b/surrogate"), "\ud800")
+        reloaded = FileSystem(state_file=self.state_file)
+        self.assertEqual(reloaded.read_file("/b/bin"), b"\x00\x01")
+        self.assertEqual(reloaded.read_file("/b/surrogate"), "\ud800")
+        reloaded.content_store.close()
+
+    def test_unbounded_store_skips_byte_accounting(self):
+        store = ContentStore()
+        store.attach(File("a.txt", "aaaa"))
+        self.assertIsNone(store.statistics()["resident_bytes"])
+
+class TestAsyncFileSystem(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.state_file = 'async_state.pkl'
+        if os.path.exists(self.state_file):
+            os.remove(self.state_file)
+        self.fs = AsyncFileSystem(state_file=self.state_file)
+
+    async def asyncTearDown(self):
+        await self.fs.close()
+        if os.path.exists(self.state_file):
+            os.remove(self.state_file)
+
+    async def test_create_and_read_file(self):
+        await self.fs.create_file("/home/user", "test.txt", "Hello World")
+        content = await self.fs.read_file("/home/user/test.txt")
+        self.assertEqual(content, "Hello World")
+
+    async def test_write_is_persisted(self):
+        await self.fs.create_file("/home/user", "test.txt", "Hello World")
+        await self.fs.write_file("/home/user/test.txt", "Updated")
+        reloaded = FileSystem(state_file=self.state_file)
+        self.assertEqual(reloaded.read_file("/home/user/test.txt"), "Updated")
+
+    async def test_concurrent_writes_share_persists(self):
+        await asyncio.gather(*(
+            self.fs.create_file("/home/user", f"file{i}.txt", "data") for i in range(20)
+        ))
+        self.assertLess(self.fs.persist_count, 20)
+        reloaded = FileSystem(state_file=self.state_file)
+        self.assertEqual(len(reloaded.list_dir("/home/user")["files"]), 20)
+
+    async def test_slow_saves_do_not_stall_the_loop(self):
+        stalls = []
+
+        async def ticker():
+            while True:
+                before = time.perf_counter()
+                await asyncio.sleep(0.01)
+                stalls.append(time.perf_counter() - before - 0.01)
+
+        ticking = asyncio.create_task(ticker())
+        with mock.patch.object(FileSystem, 'save_state', autospec=True, side_effect=lambda fs: time.sleep(0.2)):
+            await asyncio.gather(*(
+                self.fs.create_file("/home/user", f"file{i}.txt", "data") for i in range(10)
+            ))
+        ticking.cancel()
+        self.assertLess(max(stalls), 0.1)
+
+    async def test_budget_serves_contents_through_executor(self):
+        await self.fs.close()
+        self.fs = AsyncFileSystem(state_file=self.state_file, memory_budget=10)
+        await self.fs.create_file("/home", "a.txt", "aaaaaaaa")
+        await self.fs.create_file("/home", "b.txt", "bbbbbbbb")
+        self.assertEqual(await self.fs.read_file("/home/a.txt"), "aaaaaaaa")
+        stats = await self.fs.cache_statistics()
+        self.assertEqual(stats["faults"], 1)
+        self.assertLessEqual(stats["resident_bytes"], 10)
+
+    async def test_close_drains_queued_writers(self):
+        await self.fs.close()
+        self.fs = AsyncFileSystem(state_file=self.state_file, memory_budget=10)
+        real_save = FileSystem.save_state
+
+        def slow_save(fs):
+            time.sleep(0.2)
+            real_save(fs)
+
+        with mock.patch.object(FileSystem, 'save_state', autospec=True, side_effect=slow_save):
+            writers = [asyncio.create_task(self.fs.create_file("/d", "x", "x" * 8))]
+            await asyncio.sleep(0.05)
+            # y and z queue on the lock behind the save of x
+            writers += [asyncio.create_task(self.fs.create_file("/d", name, name * 8)) for name in "yz"]
+            await asyncio.sleep(0.01)
+            await self.fs.close()
+            results = await asyncio.gather(*writers, return_exceptions=True)
+        self.assertEqual(results, [None, None, None])
+        reloaded = FileSystem(state_file=self.state_file)
+        self.assertEqual(sorted(reloaded.list_dir("/d")["files"]), ["x", "y", "z"])
+
+    async def test_tree_reads_do_not_wait_for_saves(self):
+        await self.fs.close()
+        self.fs = AsyncFileSystem(state_file=self.state_file, memory_budget=10)
+        await self.fs.create_file("/home", "a.txt", "aaaaaaaa")
+        with mock.patch.object(FileSystem, 'save_state', autospec=True, side_effect=lambda fs: time.sleep(0.3)):
+            writing = asyncio.create_task(self.fs.write_file("/home/a.txt", "changed"))
+            await asyncio.sleep(0.05)
+            before = time.perf_counter()
+            contents = await self.fs.list_dir("/home")
+            stats = await self.fs.statistics()
+            self.assertLess(time.perf_counter() - before, 0.1)
+            await writing
+        self.assertEqual(contents["files"], ["a.txt"])
+        self.assertEqual(stats["total_files"], 1)
+
+    async def test_failed_save_reaches_every_writer(self):
+        with mock.patch.object(FileSystem, 'save_state', autospec=True, side_effect=OSError("disk full")):
+            results = await asyncio.gather(*(
+                self.fs.create_file("/home/user", f"file{i}.txt", "data") for i in range(3)
+            ), return_exceptions=True)
+        self.assertTrue(all(isinstance(result, OSError) for result in results))
+
+    async def test_calls_after_close_are_rejected(self):
+        await self.fs.close()
+        with self.assertRaises(RuntimeError):
+            await self.fs.read_file("/home/user/test.txt")
+        with self.assertRaises(RuntimeError):
+            await self.fs.create_file("/home/user", "test.txt", "Hello World")
+
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file